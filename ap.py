@@ -2,101 +2,185 @@
 # -*- coding: utf-8 -*-
 """
 ap.py —— 补丁应用模块：
-提供 apply_patch_to_repo(repo_dir: Path, patch_content: str, env_dir: Path, reverse: bool=False) 函数，
+提供 apply_patch_to_repo(repo_dir: Path, patch_content: bytes | str, reverse: bool=False) 函数，
 在指定的本地仓库目录 repo_dir 中依次尝试应用给定的补丁内容，并在函数内部打印中文提示。
+底层基于 asyncio 子进程实现，可通过 apply_patches_batch 在多个仓库上并发应用补丁。
 
 函数接口：
-    apply_patch_to_repo(repo_dir, patch_content, env_dir, reverse=False) -> bool
+    apply_patch_to_repo(repo_dir, patch_content, reverse=False) -> bool
+    async apply_patch_to_repo_async(repo_dir, patch_content, reverse=False) -> bool
+    async apply_patches_batch(items) -> list[bool]
 
 参数：
     repo_dir (Path)      : 本地仓库根目录
-    patch_content (str)  : 补丁文本内容
-    env_dir (Path)       : 虚拟环境路径（由 uv_env 返回的完整路径）
+    patch_content (bytes | str) : 补丁内容；传入 bytes 时原样送入 stdin，无需解码再编码
     reverse (bool)       : 是否反向应用补丁（用于还原或撤销）
 
 功能：
-    - 将 patch_content 写入临时文件
-    - 依次尝试多种补丁应用命令
+    - 通过标准输入将 patch_content 直接传给 git apply / patch（不写临时文件）
+    - 先用 git apply --check 预检，能干净应用时只执行一次 git apply
+    - 仅当预检报告“补丁无法应用”时，才回退到 patch --fuzz 模糊应用
+    - 正式应用时逐行转发 git / patch 的输出，不在内存中缓存完整输出
     - 成功时打印“补丁应用成功”或“补丁还原成功”，并返回 True
     - 全部失败后打印“补丁应用失败”，并返回 False
 
 使用示例：
-    success = apply_patch_to_repo(Path('/path/repo'), patch_str, Path('env/myenv'))
+    success = apply_patch_to_repo(Path('/path/repo'), patch_str)
+    results = asyncio.run(apply_patches_batch([(repo_a, patch_a), (repo_b, patch_b)]))
 
-注意：该函数会在临时文件中写入 patch_content，并调用 shell 执行 git apply 或 patch。
+注意：该函数直接执行 git apply 或 patch（不经过 shell），
+      git 与 patch 均不依赖虚拟环境，因此无需激活 venv。
 """
 from pathlib import Path
+import asyncio
+import re
+import shutil
 import subprocess
-import tempfile
+import sys
 
-# 可尝试的命令列表
-GIT_APPLY_COMMANDS = [
-    "git apply --verbose",
-    "git apply --verbose --reject",
-    "patch --batch --fuzz=5 -p1 -i"
-]
+from git_ops import git_argv
 
-def apply_patch_to_repo(repo_dir: Path, patch_content: str, env_dir: Path, reverse: bool = False) -> bool:
+PATCH_EXE = shutil.which("patch") or "patch"
+
+# 预检命令、正式应用命令与模糊回退命令
+GIT_APPLY_CHECK   = ["git", "apply", "--check"]
+GIT_APPLY_COMMAND = ["git", "apply", "--verbose"]
+PATCH_FALLBACK    = ["patch", "--batch", "--fuzz=5", "-p1"]
+
+# git apply --check 失败时，只有上下文不匹配才值得交给 patch 模糊应用
+_NOT_APPLICABLE_RE = re.compile(rb"patch does not apply|while searching for")
+
+# 逐行转发输出时单行的最大长度（asyncio 默认 64 KiB）
+STREAM_LINE_LIMIT = 1 << 20
+_LINE_PREFIX = "   ↪ ".encode('utf-8')
+
+
+def _command_argv(cmd: list[str], repo_dir: Path) -> list[str]:
+    """
+    git 用 -C、patch 用 -d 指定仓库目录，而不是传 cwd=，
+    使子进程能走 posix_spawn 快速路径（详见 git_ops.run_git）。
+    """
+    if cmd[0] == "git":
+        return git_argv(repo_dir, *cmd[1:])
+    return [PATCH_EXE, "-d", str(repo_dir), *cmd[1:]]
+
+
+def _echo(data: bytes) -> None:
+    """原样输出子进程的字节输出；只有 stdout 不支持字节写入时才解码。"""
+    buffer = getattr(sys.stdout, 'buffer', None)
+    if buffer is None:
+        print(data.decode(errors='replace'), end='')
+        return
+    sys.stdout.flush()
+    buffer.write(data)
+    buffer.flush()
+
+
+async def _run_patch_command(cmd: list[str], patch_data: bytes, repo_dir: Path, reverse: bool) -> tuple[int, bytes]:
+    """执行单条补丁命令（补丁内容经 stdin 传入），返回 (returncode, stderr 原始字节)。"""
+    proc = await asyncio.create_subprocess_exec(
+        *_command_argv(cmd, repo_dir), *(["--reverse"] if reverse else []),
+        close_fds=False,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE
+    )
+    _, stderr = await proc.communicate(patch_data)
+    return proc.returncode, stderr
+
+
+async def _stream_patch_command(cmd: list[str], patch_data: bytes, repo_dir: Path, reverse: bool) -> int:
+    """
+    执行单条补丁命令并逐行转发其输出（stderr 合并到 stdout），返回 returncode。
+    输出边读边打印，不会把大补丁的全部输出缓存在内存中。
     """
-    在 repo_dir 中依次尝试使用多种命令应用补丁。
+    proc = await asyncio.create_subprocess_exec(
+        *_command_argv(cmd, repo_dir), *(["--reverse"] if reverse else []),
+        close_fds=False,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        limit=STREAM_LINE_LIMIT
+    )
+
+    async def _feed_stdin():
+        try:
+            proc.stdin.write(patch_data)
+            await proc.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # 子进程提前退出，返回码会说明原因
+        finally:
+            proc.stdin.close()
+
+    feeder = asyncio.create_task(_feed_stdin())
+    async for line in proc.stdout:
+        _echo(_LINE_PREFIX + line)
+    await feeder
+    return await proc.wait()
+
+
+async def apply_patch_to_repo_async(repo_dir: Path, patch_content: bytes | str, reverse: bool = False) -> bool:
+    """
+    apply_patch_to_repo 的异步版本：在 repo_dir 中先预检补丁，再选择一条命令应用补丁。
     成功则打印中文提示并返回 True，否则打印失败提示并返回 False。
     
     :param repo_dir: 仓库路径
-    :param patch_content: 补丁内容
-    :param env_dir: 虚拟环境路径
+    :param patch_content: 补丁内容（bytes 或 str）
     :param reverse: 是否反向应用补丁（默认 False）
     :return: 是否成功应用补丁
     """
-    print(f"正在应用补丁：{patch_content[:50]}...")  # 打印补丁的前50个字符以便调试
+    patch_data = patch_content if isinstance(patch_content, bytes) else patch_content.encode('utf-8')
+    print(f"正在应用补丁：{patch_data[:50].decode('utf-8', errors='replace')}...")  # 打印补丁的前50个字节以便调试
     repo_dir = Path(repo_dir)
     if not repo_dir.is_dir():
         raise FileNotFoundError(f"仓库目录未找到: {repo_dir}")
 
-    # 确保虚拟环境的 activate 脚本存在
-    activate_script = env_dir / "bin" / "activate"
-    if not activate_script.exists():
-        raise FileNotFoundError(f"虚拟环境的激活脚本未找到: {activate_script}")
-
-    # 写入临时补丁文件
-    with tempfile.NamedTemporaryFile('w', delete=False, suffix='.diff') as tf:
-        tf.write(patch_content)
-        temp_file = Path(tf.name)
-
-    try:
-        # 依次尝试应用补丁
-        for cmd in GIT_APPLY_COMMANDS:
-            full_cmd = f"source ~/autodl-tmp/uv-smith1/{env_dir}/bin/activate && {cmd} {temp_file}"
-            if reverse:
-                full_cmd += " --reverse"
-            result = subprocess.run(
-                full_cmd,
-                shell=True,
-                cwd=str(repo_dir),
-                executable='/bin/bash',
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True
-            )
-            if result.returncode == 0:
-                action = '还原' if reverse else '应用'
-                print(f"补丁{action}成功：{cmd}")
-                return True
-            else:
-                # 打印错误信息
-                print(f"补丁应用失败，错误信息：\n{result.stderr}")
-                print(f"补丁应用失败：{result.stdout}")
-
-    finally:
-        # 清理临时文件
-        try:
-            temp_file.unlink()
-        except Exception:
-            pass
+    action = '还原' if reverse else '应用'
+
+    # 预检：能干净应用就只执行一次 git apply
+    returncode, check_stderr = await _run_patch_command(GIT_APPLY_CHECK, patch_data, repo_dir, reverse)
+    if returncode == 0:
+        cmd = GIT_APPLY_COMMAND
+    elif _NOT_APPLICABLE_RE.search(check_stderr):
+        print(f"git apply 预检未通过，尝试模糊应用：\n{check_stderr.decode(errors='replace')}")
+        cmd = PATCH_FALLBACK
+    else:
+        # 补丁本身损坏等确定性错误，回退命令也不会成功
+        print(f"补丁应用失败，错误信息：\n{check_stderr.decode(errors='replace')}")
+        print("补丁应用失败：所有尝试均未成功。")
+        return False
+
+    # 正式应用：输出直接流式打印，失败时错误信息已在上方
+    returncode = await _stream_patch_command(cmd, patch_data, repo_dir, reverse)
+    if returncode == 0:
+        print(f"补丁{action}成功：{' '.join(cmd)}")
+        return True
 
-    print("补丁应用失败：所有尝试均未成功。")
+    print(f"补丁应用失败：{' '.join(cmd)} 返回码 {returncode}，所有尝试均未成功。")
     return False
 
 
+def apply_patch_to_repo(repo_dir: Path, patch_content: bytes | str, reverse: bool = False) -> bool:
+    """
+    在 repo_dir 中先预检补丁，再选择一条命令应用补丁（同步接口）。
+    成功则打印中文提示并返回 True，否则打印失败提示并返回 False。
+    
+    :param repo_dir: 仓库路径
+    :param patch_content: 补丁内容（bytes 或 str）
+    :param reverse: 是否反向应用补丁（默认 False）
+    :return: 是否成功应用补丁
+    """
+    return asyncio.run(apply_patch_to_repo_async(repo_dir, patch_content, reverse=reverse))
+
+
+async def apply_patches_batch(items) -> list[bool]:
+    """
+    并发地将多个补丁应用到各自的仓库，返回与 items 顺序一致的结果列表。
+    items 中每一项为 (repo_dir, patch_content) 或 (repo_dir, patch_content, reverse)。
+    注意：同一仓库的多个补丁之间存在先后依赖，不应放进同一批次。
+    """
+    return await asyncio.gather(*[apply_patch_to_repo_async(*item) for item in items])
+
 
 # 脚本独立调用支持
 if __name__ == '__main__':
@@ -104,9 +188,8 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='应用或还原补丁到本地仓库')
     parser.add_argument('--repo_dir',   required=True, type=Path, help='本地仓库目录')
     parser.add_argument('--patch_file', required=True, type=Path, help='补丁文件路径')
-    parser.add_argument('--env_dir',    required=True, type=Path, help='虚拟环境路径')
     parser.add_argument('--reverse',    action='store_true', help='是否反向应用')
     args = parser.parse_args()
-    patch_text = args.patch_file.read_text(encoding='utf-8')
-    ok = apply_patch_to_repo(args.repo_dir, patch_text, args.env_dir, reverse=args.reverse)
+    patch_data = args.patch_file.read_bytes()
+    ok = apply_patch_to_repo(args.repo_dir, patch_data, reverse=args.reverse)
     exit(0 if ok else 1)
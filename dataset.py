@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+dataset.py —— 数据集访问模块：
+提供 load_instance(dataset_path: Path, instance_id: str) 函数，
+从 JSONL 数据集中读取指定 instance_id 的记录。
+
+索引保存在数据集旁的 SQLite 文件 .idx.sqlite 中：
+    idx(instance_id PRIMARY KEY, repo, base_commit, line_offset)
+既能按 instance_id O(1) 定位到行首字节偏移，也能按 repo / base_commit 筛选实例。
+
+查找顺序：
+  1. 若已有有效的索引库，查出字节偏移后直接 seek 到对应行；
+  2. 否则若数据集所在目录可写，先一次性扫描建立索引库（之后每次运行都走第 1 步），再按索引查找；
+  3. 目录不可写时 mmap 整个文件，按字节串查找 '"instance_id": "<id>"'（及紧凑格式 '"instance_id":"<id>"'），
+     只解析命中的那一行；字节串未命中（如字段格式不同）时，在内存中建立索引再查找。
+数据集文件发生变化（mtime 或大小不同）时，旧索引自动失效。
+也可以提前执行 `python dataset.py --dataset <path> --build_index` 预先建好索引。
+
+安装了 orjson 时使用 orjson 解析（明显快于标准库 json），否则回退到 json。
+
+load_instance 返回的记录中，FAIL_TO_PASS / PASS_TO_PASS 已统一解析为 list[str]，下游无需再解析。
+
+接口：
+    load_instance(dataset_path, instance_id) -> dict
+    parse_test_list(raw) -> list[str]
+    parse_instance_id(instance_id) -> InstanceId(owner, repo, base_commit)
+    find_instance_ids(dataset_path, repo=None, base_commit=None) -> list[str]
+    build_index(dataset_path) -> int
+"""
+from functools import lru_cache
+from pathlib import Path
+from typing import NamedTuple
+import ast
+import json
+import mmap
+import os
+import re
+import sqlite3
+
+try:
+    import orjson
+except ImportError:  # orjson 为可选依赖
+    orjson = None
+
+_loads = orjson.loads if orjson is not None else json.loads
+
+# 索引库允许 SQLite 使用的 mmap 上限（字节）
+INDEX_MMAP_SIZE = 256 * 1024 * 1024
+
+# 只用正则提取每行的 instance_id 及行首位置，建索引时无需完整解析每一行 JSON
+_INSTANCE_LINE_RE = re.compile(rb'^[^\n]*?"instance_id"\s*:\s*"([^"]+)"', re.M)
+
+
+def _index_path(dataset_path: Path) -> Path:
+    return dataset_path.with_suffix('.idx.sqlite')
+
+
+def _iter_index_rows(dataset_path: Path):
+    """扫描一遍数据集，逐行产出 (instance_id, repo, base_commit, 行首字节偏移)。"""
+    if dataset_path.stat().st_size == 0:
+        return
+    with dataset_path.open('rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for m in _INSTANCE_LINE_RE.finditer(mm):
+            instance_id = m.group(1).decode('utf-8')
+            try:
+                _, repo, base_commit = parse_instance_id(instance_id)
+            except ValueError:
+                repo = base_commit = None
+            yield instance_id, repo, base_commit, m.start()
+
+
+def _connect(db_path) -> sqlite3.Connection:
+    conn = sqlite3.connect(db_path)
+    conn.execute(f"PRAGMA mmap_size={INDEX_MMAP_SIZE}")
+    return conn
+
+
+def _open_index(dataset_path: Path, mtime_ns: int, size: int) -> sqlite3.Connection | None:
+    """打开与数据集匹配的索引库；索引不存在、损坏或已过期时返回 None。"""
+    idx_path = _index_path(dataset_path)
+    if not idx_path.exists():
+        return None
+    conn = None
+    try:
+        conn = _connect(idx_path)
+        meta = dict(conn.execute("SELECT key, value FROM meta"))
+        if meta.get('mtime_ns') == mtime_ns and meta.get('size') == size:
+            return conn
+    except sqlite3.DatabaseError:
+        pass
+    if conn is not None:
+        conn.close()
+    return None
+
+
+def _fill_index(conn: sqlite3.Connection, dataset_path: Path, mtime_ns: int, size: int) -> None:
+    with conn:
+        conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value INTEGER)")
+        conn.execute(
+            "CREATE TABLE idx (instance_id TEXT PRIMARY KEY, repo TEXT, base_commit TEXT, line_offset INTEGER)"
+        )
+        conn.executemany("INSERT OR IGNORE INTO idx VALUES (?, ?, ?, ?)", _iter_index_rows(dataset_path))
+        conn.execute("CREATE INDEX idx_repo_commit ON idx (repo, base_commit)")
+        conn.executemany("INSERT INTO meta VALUES (?, ?)", [('mtime_ns', mtime_ns), ('size', size)])
+
+
+def _build_index(dataset_path: Path, mtime_ns: int, size: int) -> sqlite3.Connection:
+    """
+    扫描数据集建立索引，先写入临时文件再原子替换到 .idx.sqlite；
+    无法写盘时退化为内存中的索引（仅本次进程可用）。
+    """
+    print(f"正在为数据集建立索引: {dataset_path}")
+    idx_path = _index_path(dataset_path)
+    tmp_path = idx_path.with_name(f"{idx_path.name}.{os.getpid()}.tmp")
+    try:
+        tmp_path.unlink(missing_ok=True)
+        conn = _connect(tmp_path)
+        try:
+            _fill_index(conn, dataset_path, mtime_ns, size)
+        finally:
+            conn.close()
+        os.replace(tmp_path, idx_path)
+        return _connect(idx_path)
+    except (OSError, sqlite3.Error) as e:
+        print(f"⚠️ 索引写入失败（改用内存索引）：{e}")
+        tmp_path.unlink(missing_ok=True)
+        conn = sqlite3.connect(':memory:')
+        _fill_index(conn, dataset_path, mtime_ns, size)
+        return conn
+
+
+def _ensure_index(dataset_path: Path) -> sqlite3.Connection:
+    st = dataset_path.stat()
+    conn = _open_index(dataset_path, st.st_mtime_ns, st.st_size)
+    return conn if conn is not None else _build_index(dataset_path, st.st_mtime_ns, st.st_size)
+
+
+def _find_line_mmap(dataset_path: Path, instance_id: str) -> bytes | None:
+    """mmap 数据集并按字节串定位 instance_id 所在行，未命中返回 None。"""
+    value = json.dumps(instance_id).encode('utf-8')
+    fd = os.open(dataset_path, os.O_RDONLY)
+    try:
+        if os.fstat(fd).st_size == 0:
+            return None
+        with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as mm:
+            # json.dumps 默认输出带空格，orjson 等紧凑输出不带空格，两种写法都试一次
+            for sep in (b': ', b':'):
+                pos = mm.find(b'"instance_id"' + sep + value)
+                if pos >= 0:
+                    start = mm.rfind(b'\n', 0, pos) + 1
+                    end = mm.find(b'\n', pos)
+                    return mm[start:end if end >= 0 else len(mm)]
+            return None
+    finally:
+        os.close(fd)
+
+
+def parse_test_list(raw) -> list[str]:
+    """
+    将 FAIL_TO_PASS / PASS_TO_PASS 字段统一为 nodeid 列表。
+    支持：列表/元组、JSON 字符串 '["a::b", "c::d"]'、Python 字面量 "['a::b', 'c::d']"，
+    以及不带引号的 "[a::b, c::d]" 或 "a::b,c::d"。
+    """
+    if isinstance(raw, (list, tuple)):
+        return list(raw)
+    if not isinstance(raw, str) or not raw.strip():
+        return []
+    s = raw.strip()
+    try:
+        parsed = _loads(s)
+    except ValueError:
+        try:
+            parsed = ast.literal_eval(s)
+        except (ValueError, SyntaxError):
+            parsed = None
+    if isinstance(parsed, (list, tuple)):
+        return [str(t) for t in parsed]
+    # 兜底：不带引号的逗号分隔格式；参数化 id 中的逗号（如 "t.py::a[1,2]"）不作为分隔符
+    if s.startswith('[') and s.endswith(']'):
+        s = s[1:-1]
+    items, depth, start = [], 0, 0
+    for i, ch in enumerate(s):
+        if ch == '[':
+            depth += 1
+        elif ch == ']':
+            depth = max(depth - 1, 0)
+        elif ch == ',' and depth == 0:
+            items.append(s[start:i])
+            start = i + 1
+    items.append(s[start:])
+    return [t.strip() for t in items if t.strip()]
+
+
+def _normalize_item(item: dict) -> dict:
+    for key in ('FAIL_TO_PASS', 'PASS_TO_PASS'):
+        item[key] = parse_test_list(item.get(key))
+    return item
+
+
+def load_instance(dataset_path: Path, instance_id: str) -> dict:
+    """从 JSONL 数据集中加载对应 instance_id 的记录"""
+    dataset_path = Path(dataset_path)
+    if not dataset_path.exists():
+        raise FileNotFoundError(f"数据集文件不存在: {dataset_path}")
+    st = dataset_path.stat()
+    conn = _open_index(dataset_path, st.st_mtime_ns, st.st_size)
+    if conn is None and os.access(dataset_path.parent, os.W_OK):
+        # 首次访问时建立持久索引，之后的每次运行都是 O(1) 查找
+        conn = _build_index(dataset_path, st.st_mtime_ns, st.st_size)
+    if conn is None:
+        line = _find_line_mmap(dataset_path, instance_id)
+        if line is not None:
+            return _normalize_item(_loads(line))
+        conn = _build_index(dataset_path, st.st_mtime_ns, st.st_size)
+    try:
+        row = conn.execute("SELECT line_offset FROM idx WHERE instance_id = ?", (instance_id,)).fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        raise KeyError(f'Instance {instance_id} not found')
+    with dataset_path.open('rb') as f:
+        f.seek(row[0])
+        return _normalize_item(_loads(f.readline()))
+
+
+def find_instance_ids(dataset_path: Path, repo: str | None = None, base_commit: str | None = None) -> list[str]:
+    """按 repo / base_commit 筛选数据集中的 instance_id（按数据集中的顺序），需要时先建立索引。"""
+    dataset_path = Path(dataset_path)
+    if not dataset_path.exists():
+        raise FileNotFoundError(f"数据集文件不存在: {dataset_path}")
+    conditions, params = [], []
+    if repo is not None:
+        conditions.append("repo = ?")
+        params.append(repo)
+    if base_commit is not None:
+        conditions.append("base_commit = ?")
+        params.append(base_commit)
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+    conn = _ensure_index(dataset_path)
+    try:
+        rows = conn.execute(f"SELECT instance_id FROM idx{where} ORDER BY line_offset", params).fetchall()
+    finally:
+        conn.close()
+    return [r[0] for r in rows]
+
+
+def build_index(dataset_path: Path) -> int:
+    """（重新）建立数据集的索引库，返回索引中的实例数。"""
+    dataset_path = Path(dataset_path)
+    if not dataset_path.exists():
+        raise FileNotFoundError(f"数据集文件不存在: {dataset_path}")
+    st = dataset_path.stat()
+    conn = _build_index(dataset_path, st.st_mtime_ns, st.st_size)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM idx").fetchone()[0]
+    finally:
+        conn.close()
+
+
+class InstanceId(NamedTuple):
+    owner: str
+    repo: str
+    base_commit: str
+
+
+@lru_cache(maxsize=4096)
+def parse_instance_id(instance_id: str) -> InstanceId:
+    """
+    解析 instance_id，例如 'scanny__python-pptx.278b47b1.combine_file__00zilcc6'
+    -> InstanceId(owner='scanny', repo='python-pptx', base_commit='278b47b1')
+    """
+    # 用 partition 只切出需要的字段，不构造完整的 split 列表
+    prefix, sep, rest = instance_id.partition('.')
+    if not sep:
+        raise ValueError(f"无法解析的 instance_id: {instance_id}")
+    owner, _, repo = prefix.rpartition('__')
+    return InstanceId(owner, repo, rest.partition('.')[0])
+
+
+# 测试脚本支持
+if __name__ == '__main__':
+    import argparse
+    import sys
+    parser = argparse.ArgumentParser(description='查询 JSONL 数据集或预先建立索引')
+    parser.add_argument('--dataset',     required=True, type=Path, help='JSONL 数据集路径')
+    parser.add_argument('--build_index', action='store_true', help='重新建立数据集索引')
+    parser.add_argument('--instance_id', help='要查询的 instance_id')
+    args = parser.parse_args()
+
+    try:
+        if args.build_index:
+            count = build_index(args.dataset)
+            print(f"✅ 索引已建立：{_index_path(args.dataset)}（{count} 个实例）")
+        if args.instance_id:
+            item = load_instance(args.dataset, args.instance_id)
+            print(json.dumps(item, indent=2, ensure_ascii=False))
+    except Exception as e:
+        print(f"❌ 运行时发生错误: {e}", file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+git_ops.py —— 仓库状态管理模块：
+提供基于镜像裸仓库创建与删除 worktree 的函数，供各 run*.py 主控脚本共用。
+
+接口：
+    ensure_mirror(repo_dir, commit=None) -> Path
+    add_worktree(repo_dir, commit, worktrees_root) -> Path
+    remove_worktree(repo_dir, worktree_dir)
+    run_git(repo_dir, *args, **kwargs) -> subprocess.CompletedProcess
+    git_argv(repo_dir, *args) -> list[str]
+
+所有 git 调用都经由 run_git：以绝对路径执行 git、用 `git -C <dir>` 代替 cwd=、且不设置 close_fds，
+满足这些条件时 CPython 会用 posix_spawn 启动子进程，省去对整个地址空间的 fork()。
+（Python 创建的文件描述符默认不可继承，因此 close_fds=False 不会把多余的 fd 泄漏给 git。）
+
+评测流程使用 worktree：每个实例在共享对象库的独立工作区中检出 base commit，
+不修改 repo_dir 自身的 HEAD，多个实例可以并行评测，结束后直接删除 worktree 即可。
+worktree 统一挂在 repo_dir 旁边的镜像裸仓库 <repo_dir>.git 上（首次使用时从 repo_dir
+本地 clone --mirror，对象以硬链接共享），repo_dir 自身的 .git/worktrees 与工作区始终不受影响。
+worktree 只包含已跟踪的文件：repo_dir 中未跟踪的构建产物（原地编译的 C 扩展、被忽略的 _version.py 等）
+不会出现在其中；以可编辑模式安装的 src 布局包也仍指向 repo_dir，而不是 worktree。
+"""
+from pathlib import Path
+import os
+import shutil
+import subprocess
+import uuid
+
+GIT_EXE = shutil.which("git") or "git"  # posix_spawn 要求可执行文件带目录部分
+
+
+def git_argv(repo_dir: Path, *args: str) -> list[str]:
+    """构造在 repo_dir 中执行的 git 命令行。"""
+    return [GIT_EXE, "-C", str(repo_dir), *args]
+
+
+def run_git(repo_dir: Path, *args: str, **kwargs) -> subprocess.CompletedProcess:
+    """在 repo_dir 中执行 git 子命令，其余参数透传给 subprocess.run。"""
+    kwargs.setdefault("close_fds", False)
+    return subprocess.run(git_argv(repo_dir, *args), **kwargs)
+
+
+def _mirror_path(repo_dir: Path) -> Path:
+    return Path(repo_dir).with_name(f"{Path(repo_dir).name}.git")
+
+
+def ensure_mirror(repo_dir: Path, commit: str | None = None) -> Path:
+    """
+    返回 repo_dir 对应的镜像裸仓库 <repo_dir>.git，不存在时从 repo_dir 本地克隆一次。
+    给出 commit 且镜像中缺少该 commit 时（repo_dir 之后又拉取了新提交，或该 commit 不在任何 ref 上，
+    如按 SHA 拉取、只存在于 detached HEAD），在 repo_dir 中解析出完整哈希后按哈希增量 fetch。
+    """
+    mirror = _mirror_path(repo_dir)
+    if not mirror.is_dir():
+        print(f"创建镜像裸仓库: {mirror}")
+        # 先克隆到临时目录再改名，避免并发评测时看到克隆到一半的仓库
+        tmp = mirror.with_name(f"{mirror.name}.tmp-{uuid.uuid4().hex[:8]}")
+        subprocess.run([GIT_EXE, "clone", "--mirror", "--quiet", str(repo_dir), str(tmp)], check=True, close_fds=False)
+        try:
+            os.rename(tmp, mirror)
+        except OSError:
+            # 其他进程已抢先创建好镜像，直接复用
+            shutil.rmtree(tmp, ignore_errors=True)
+    if commit is not None:
+        probe = run_git(mirror, "cat-file", "-e", f"{commit}^{{commit}}", capture_output=True)
+        if probe.returncode != 0:
+            print(f"镜像中缺少 commit {commit}，从 {repo_dir} 同步...")
+            # clone --mirror 与按 refspec fetch 只会带上 ref 可达的提交，这里直接按完整哈希拉取
+            resolved = run_git(repo_dir, "rev-parse", "--verify", "--quiet", f"{commit}^{{commit}}",
+                               capture_output=True, check=True)
+            run_git(mirror, "fetch", "--quiet", "origin", resolved.stdout.strip().decode('ascii'), check=True)
+    return mirror
+
+
+def add_worktree(repo_dir: Path, commit: str, worktrees_root: Path) -> Path:
+    """在 worktrees_root 下基于镜像裸仓库创建检出到 commit 的独立 worktree（detached HEAD），返回其绝对路径。"""
+    mirror = ensure_mirror(repo_dir, commit)
+    worktrees_root.mkdir(parents=True, exist_ok=True)
+    # git -C 会相对镜像仓库解析相对路径，因此这里必须使用绝对路径
+    worktree_dir = (worktrees_root / f"{Path(repo_dir).name}-{commit}-{uuid.uuid4().hex[:8]}").resolve()
+    print(f"创建 worktree: {worktree_dir}（commit: {commit}）")
+    run_git(mirror, "worktree", "add", "--detach", str(worktree_dir), commit, check=True)
+    return worktree_dir
+
+
+def remove_worktree(repo_dir: Path, worktree_dir: Path) -> None:
+    """删除 add_worktree 创建的 worktree，连同其中的补丁改动与未跟踪文件。"""
+    print(f"删除 worktree: {worktree_dir}")
+    run_git(_mirror_path(repo_dir), "worktree", "remove", "--force", str(worktree_dir), check=True)
@@ -3,63 +3,49 @@
 """
 run_eval.py — 主控程序：
 负责整个本地验证流程的编排，依次调用以下模块：
+  0. dataset.py —— 数据集实例加载
   1. uv_env.py —— 环境准备
   2. ap.py     —— 补丁应用
   3. test.py   —— 测试运行与验证
 
 脚本顶部通过常量配置相对路径，无需命令行参数。
+注意：测试在干净的 worktree 中运行，repo_dir 中未跟踪的构建产物（原地编译的 C 扩展、被 gitignore 的
+setuptools_scm _version.py 等）不会带入；若环境以可编辑模式安装了 src 布局的包，导入的仍是 repo_dir 中未打补丁的代码。
 """
 from pathlib import Path
 import json
+import shutil
 import sys
-import subprocess
+import tempfile
 
 # 导入模块化脚本
+from dataset import load_instance, parse_instance_id
+from git_ops import add_worktree, remove_worktree
 from uv_env import setup_environment
 from ap import apply_patch_to_repo
-from test import run_tests_on_repo
+from test import compile_repo, run_test_phases, run_tests_on_repo
 
 # ------------------ 配置区域（相对项目根目录） ------------------
 DATASET_PATH   = Path('data/swe-smith.jsonl')
 REPOS_ROOT     = Path('repo')
+WORKTREES_ROOT = REPOS_ROOT / '.worktrees'
 INSTANCE_ID    = 'scanny__python-pptx.278b47b1.combine_file__00zilcc6'
 FIX_PATCH_FILE = Path('fixes/your_fix.patch')
 UV_ENV_NAME    = 'pptx'
+USE_TMPFS      = False            # True 时把 worktree 建在 tmpfs 上，测试期间的文件读写都在内存中完成
+TMPFS_ROOT     = Path('/dev/shm')
+REPAIR_LAST_FAILED = False        # True 时复测阶段用 pytest --lf，只重跑首次验证中未通过的 FAIL_TO_PASS 用例
 # ----------------------------------------------------------------
 
-def load_instance(dataset_path: Path, instance_id: str) -> dict:
-    """从 JSONL 数据集中加载对应 instance_id 的记录"""
-    if not dataset_path.exists():
-        raise FileNotFoundError(f"数据集文件不存在: {dataset_path}")
-    with dataset_path.open(encoding='utf-8') as f:
-        for line in f:
-            item = json.loads(line)
-            if item.get('instance_id') == instance_id:
-                return item
-    raise KeyError(f'Instance {instance_id} not found')
-
-def extract_base_commit(instance_id: str) -> str:
-    """
-    从 instance_id 中提取 base_commit 哈希部分
-    格式为：repo_name.commit_hash，例如：'278b47b1'
-    """
-    return instance_id.split('.')[1]
-
-def switch_to_commit(repo_dir: Path, base_commit: str) -> None:
-    """
-    切换到指定的 commit
-    """
-    print(f"切换到 base commit: {base_commit}")
-    subprocess.run(["git", "reset", "--hard"], cwd=repo_dir, check=True)  # 重置当前工作区
-    subprocess.run(["git", "checkout", base_commit], cwd=repo_dir, check=True)  # 切换到 commit
-
 def main():
+    work_dir = None
+    tmpfs_dir = None
     try:
         # 1. 加载任务实例
         item = load_instance(DATASET_PATH, INSTANCE_ID)
 
         # 2. 提取 base_commit
-        base_commit = extract_base_commit(INSTANCE_ID)
+        base_commit = parse_instance_id(INSTANCE_ID).base_commit
         print(f"提取的 base_commit: {base_commit}")
 
         # 3. 确定仓库路径并创建虚拟环境
@@ -67,27 +53,46 @@ def main():
         repo_dir = REPOS_ROOT / repo_path
         env_dir = setup_environment(UV_ENV_NAME)
 
-        # 4. 切换到指定的 commit
-        switch_to_commit(repo_dir, base_commit)
+        # 4. 在指定的 commit 上创建独立的 worktree（不改动 repo_dir 自身的 HEAD）
+        worktrees_root = WORKTREES_ROOT
+        if USE_TMPFS:
+            if TMPFS_ROOT.is_dir():
+                tmpfs_dir = Path(tempfile.mkdtemp(prefix='uv-smith-', dir=TMPFS_ROOT))
+                worktrees_root = tmpfs_dir
+            else:
+                print(f"⚠️ 未找到 tmpfs 目录 {TMPFS_ROOT}，worktree 仍建在 {WORKTREES_ROOT}", file=sys.stderr)
+        work_dir = add_worktree(repo_dir, base_commit, worktrees_root)
+        log_dir = repo_dir / '.test_logs'
 
         # 5. 注入错误补丁
         error_patch = item['patch']
-        if not apply_patch_to_repo(repo_dir, error_patch, env_dir=env_dir, reverse=False):
+        if not apply_patch_to_repo(work_dir, error_patch, reverse=False):
             raise RuntimeError('注入错误补丁失败')
+        # 补丁应用后一次性并行预编译整个仓库，后续各 pytest 进程直接复用字节码
+        compile_repo(work_dir, env_dir)
 
         # 6. 首次验证：FAIL_TO_PASS 应失败，PASS_TO_PASS 应通过
         fail_tests = item.get('FAIL_TO_PASS', [])
         pass_tests = item.get('PASS_TO_PASS', [])
-        initial_fail = run_tests_on_repo(repo_dir, fail_tests, expect_fail=True, env_dir=env_dir)
-        initial_pass = run_tests_on_repo(repo_dir, pass_tests, expect_fail=False, env_dir=env_dir)
+        # 两组测试针对同一份代码、互不依赖，并发运行，总耗时取两者的较大值而非之和
+        initial_fail, initial_pass = run_test_phases(work_dir, fail_tests, pass_tests, env_dir, log_dir)
 
-        # 7. 应用用户修复补丁
-        fix_patch = FIX_PATCH_FILE.read_text(encoding='utf-8')
-        if not apply_patch_to_repo(repo_dir, fix_patch, env_dir=env_dir, reverse=False):
-            raise RuntimeError('应用修复补丁失败')
+        ok_initial = all(initial_fail[t] for t in fail_tests) and all(initial_pass[t] for t in pass_tests)
 
-        # 8. 复测 FAIL_TO_PASS
-        repair_results = run_tests_on_repo(repo_dir, fail_tests, expect_fail=False, env_dir=env_dir)
+        if ok_initial:
+            # 7. 应用用户修复补丁
+            fix_patch = FIX_PATCH_FILE.read_bytes()
+            if not apply_patch_to_repo(work_dir, fix_patch, reverse=False):
+                raise RuntimeError('应用修复补丁失败')
+
+            # 8. 复测 FAIL_TO_PASS
+            # 修复补丁可能改变可收集的用例（如修好了导入错误），复测时重新预检，不复用上面的收集结果
+            repair_results = run_tests_on_repo(work_dir, fail_tests, expect_fail=False, env_dir=env_dir, log_dir=log_dir,
+                                               last_failed=REPAIR_LAST_FAILED)
+        else:
+            # 首次验证未达预期（实例本身有问题），无论修复结果如何都会判定失败，跳过修复与复测
+            print("⚠️ 首次验证未达预期，跳过修复补丁与复测。", file=sys.stderr)
+            repair_results = {t: False for t in fail_tests}
 
         # 9. 汇总并输出
         summary = {
@@ -98,16 +103,22 @@ def main():
         print(json.dumps(summary, indent=2, ensure_ascii=False))
 
         # 10. 退出码判断
-        ok_initial = all(initial_fail[t] for t in fail_tests) and all(initial_pass[t] for t in pass_tests)
         ok_repair  = all(repair_results[t] for t in fail_tests)
         sys.exit(0 if (ok_initial and ok_repair) else 1)
 
-        # 11. 恢复仓库到初始 commit
-        subprocess.run(["git", "reset", "--hard", current_commit], cwd=repo_dir, check=True)
-
     except Exception as e:
         print(f'Error: {e}', file=sys.stderr)
         sys.exit(1)
 
+    finally:
+        # 11. 清理 worktree，repo_dir 本身始终保持原样
+        if work_dir is not None:
+            try:
+                remove_worktree(repo_dir, work_dir)
+            except Exception as e:
+                print(f"⚠️ worktree 清理失败：{e}", file=sys.stderr)
+        if tmpfs_dir is not None:
+            shutil.rmtree(tmpfs_dir, ignore_errors=True)
+
 if __name__ == '__main__':
     main()
@@ -5,9 +5,55 @@ test.py —— 测试运行模块（增强版）：
 支持运行指定测试用例 nodeid，并结构化返回测试是否符合预期结果，
 附带日志记录与详细失败信息输出。
 """
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
+import json
+import logging
+import os
+import re
+import shlex
+import signal
 import subprocess
 import sys
+import threading
+import uuid
+import xml.etree.ElementTree as ET
+
+from dataset import parse_test_list
+
+BATCH_SIZE = 50   # 单个 pytest 进程最多运行的 nodeid 数
+USAGE_ERROR = 4   # pytest.ExitCode.USAGE_ERROR（如 nodeid 指向的文件不存在）
+LAST_FAILED_ARGS = ("--lf", "--lfnf=none")  # 只跑上次失败的用例；没有失败记录时一个也不跑
+LAST_FAILED_CACHE = os.path.join(".pytest_cache", "v", "cache", "lastfailed")  # 相对于仓库根目录
+TEST_TIMEOUT_S = 120  # 每个用例的运行时间预算（秒）；pytest 进程的上限为预算 × 其运行的用例数，超时后连同子进程一起强制终止
+BATCH_TIMEOUT_S = 600  # 单个 pytest 进程的时间上限（秒），个别用例卡死时不会占住名额太久
+COLLECT_TIMEOUT_S = 300  # 预收集的时间上限（秒）；错误补丁可能让导入卡死，超时后放弃预检
+LOG_BUFFER_SIZE = 1 << 16  # 日志文件写缓冲，几段 write 合并为一次系统调用
+
+# 进程内所有 run_tests_on_repo 调用共享的 pytest 进程名额：多个测试阶段并发运行时，
+# 同时运行的 pytest 进程总数仍不超过 CPU 核数
+_PYTEST_SLOTS = threading.BoundedSemaphore(os.cpu_count() or 1)
+
+# 进度输出统一经由 logger：StreamHandler 自带锁，多线程并发时每条记录整体写出、互不交错；
+# 一个批次的全部结果合并为一条记录，一次 write 输出，而不是每个用例 3-5 次 print
+logger = logging.getLogger("runtests")
+if not logger.handlers:
+    _handler = logging.StreamHandler(sys.stdout)
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+
+# 日志文件名净化表：'[' -> '_'，']' 删除（'::' 为两个字符，单独替换为 '__'）
+_SANITIZE = str.maketrans({'[': '_', ']': None})
+
+
+@lru_cache(maxsize=128)
+def _normalize_tests_str(s: str) -> tuple[str, ...]:
+    """用 dataset.parse_test_list 解析字符串形式的 tests；同一字符串在多个测试阶段中重复出现，结果缓存复用。"""
+    return tuple(parse_test_list(s))
 
 
 def _normalize_tests(tests) -> list[str]:
@@ -15,88 +61,361 @@ def _normalize_tests(tests) -> list[str]:
     将 tests 参数转换为 nodeid 列表。
     支持：
       - 列表 ['a::b', 'c::d']
-      - 字符串 "[a::b,c::d]" 或 "a::b,c::d"
-    """
-    if isinstance(tests, str):
-        s = tests.strip()
-        if s.startswith('[') and s.endswith(']'):
-            s = s[1:-1]
-        return [t.strip() for t in s.split(',') if t.strip()]
-    elif isinstance(tests, (list, tuple)):
+      - 字符串：JSON / Python 列表字面量，或 "[a::b,c::d]"、"a::b,c::d"（参数中的逗号不拆分）
+    """
+    if isinstance(tests, (list, tuple)):
         return list(tests)
+    elif isinstance(tests, str):
+        return list(_normalize_tests_str(tests))
     else:
         raise ValueError(f"无法识别的 tests 类型：{type(tests)}")
 
 
+def _junit_key(nodeid: str) -> tuple[str, str]:
+    """
+    按 pytest 生成 junitxml 的规则（mangle_test_address）把 nodeid 映射为 (classname, name)，
+    如 'tests/test_a.py::TestX::test_y[1-2]' -> ('tests.test_a.TestX', 'test_y[1-2]')。
+    """
+    path, bracket, params = nodeid.partition('[')
+    names = path.split('::')
+    names[0] = re.sub(r'\.py$', '', names[0].replace('/', '.'))
+    names[-1] += bracket + params
+    return '.'.join(names[:-1]), names[-1]
+
+
+def _lookup_outcome(outcomes: dict[tuple[str, str], tuple[bool, str]], nodeid: str) -> tuple[bool, str] | None:
+    """
+    在 junitxml 结果中查找 nodeid 的运行结果，匹配规则与 _is_collected 一致：
+    nodeid 本身对应的用例，或它作为前缀覆盖的全部用例（类、模块、未带参数的参数化用例），
+    后者任意一条失败即视为失败。报告中没有任何匹配的用例时返回 None。
+    """
+    key = _junit_key(nodeid)
+    if key in outcomes:
+        return outcomes[key]
+    classname, name = key
+    full = f"{classname}.{name}" if classname else name
+    matched = [
+        outcome for (c, n), outcome in outcomes.items()
+        if c == full or c.startswith(full + '.') or (c == classname and n.startswith(name + '['))
+    ]
+    if not matched:
+        return None
+    return all(ok for ok, _ in matched), '\n'.join(detail for _, detail in matched if detail)
+
+
+def _parse_junit(report: str) -> dict[tuple[str, str], tuple[bool, str]]:
+    """解析 junitxml 报告：(classname, name) -> (是否运行通过, 失败详情)。"""
+    outcomes: dict[tuple[str, str], tuple[bool, str]] = {}
+    for case in ET.parse(report).iter('testcase'):
+        key = (case.get('classname', ''), case.get('name', ''))
+        problems = [el for el in case if el.tag in ('failure', 'error')]
+        detail = '\n'.join(f"{el.get('message', '')}\n{el.text or ''}".strip() for el in problems)
+        # 同一用例可能出现多条记录（如 call 失败后 teardown 又报错），任意一条失败即视为失败
+        ok, prev = outcomes.get(key, (True, ''))
+        outcomes[key] = (ok and not problems, '\n'.join(filter(None, (prev, detail))))
+    return outcomes
+
+
+@lru_cache(maxsize=8)
+def _venv_python(env_dir: Path) -> tuple[str, dict[str, str]]:
+    """
+    返回虚拟环境中 python 的绝对路径，以及按 activate 脚本方式设置好的环境变量。
+    直接调用该 python 即可省去 bash 与 source activate。
+    结果按 env_dir 缓存，预检与各测试阶段共用同一份环境变量字典（调用方不得修改）。
+    """
+    # 子进程在 repo_dir 下运行，环境路径需要先转成绝对路径
+    env_dir = os.path.abspath(env_dir)
+    bin_dir = os.path.join(env_dir, "bin")
+    python = os.path.join(bin_dir, "python")
+    if not os.path.exists(python):
+        raise FileNotFoundError(f"❌ 虚拟环境未找到: {env_dir}")
+
+    env = {**os.environ, "VIRTUAL_ENV": env_dir, "PATH": f"{bin_dir}{os.pathsep}{os.environ.get('PATH', '')}"}
+    env.pop("PYTHONHOME", None)
+    return python, env
+
+
+def compile_repo(repo_dir: Path, env_dir: Path) -> None:
+    """
+    用虚拟环境中的 python 并行执行 compileall（-j 0 使用全部 CPU 核），一次性生成仓库内所有
+    模块的 __pycache__ 字节码，之后的各个 pytest 进程导入时不必各自重新编译。
+    个别文件编译失败（如故意放置的语法错误样例）不影响后续测试，因此忽略返回码与输出。
+    """
+    python, env = _venv_python(env_dir)
+    logger.info("⚙️ 预编译仓库字节码...")
+    subprocess.run(
+        [python, "-m", "compileall", "-q", "-j", "0", os.fspath(repo_dir)],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+
+def collect_tests(repo_dir: Path, tests, env_dir: Path) -> set[str]:
+    """
+    对 tests 所在的测试文件执行一次 pytest --collect-only，返回收集到的 nodeid 集合。
+
+    pytest 本身不会持久化收集结果，这一步的收益来自副作用：导入测试文件和被测模块时
+    生成 __pycache__ 字节码与断言重写缓存，之后各测试阶段的 pytest 进程直接复用。
+    按文件（而非 nodeid）收集，个别 nodeid 写错或已不存在时不会导致整次收集失败；
+    仓库中不存在的文件会被跳过。收集出错的文件（如补丁破坏了导入）不会出现在返回集合中；
+    收集超过 COLLECT_TIMEOUT_S 时返回空集合，各用例交给批次运行按实际结果判定。
+    """
+    repo_str = os.fspath(repo_dir)
+    python, env = _venv_python(env_dir)
+    files = sorted({t.split('::', 1)[0] for t in _normalize_tests(tests)})
+    files = [f for f in files if os.path.exists(os.path.join(repo_str, f))]
+    if not files:
+        return set()
+
+    # 用 --verbosity=-1 固定输出格式（每个用例一行 nodeid）：若仓库配置了 addopts = -q，
+    # 再追加 -q 会变成 -qq，只输出每个文件的用例数
+    argv = [python, "-m", "pytest", "--collect-only", "--verbosity=-1", "--disable-warnings",
+            "--continue-on-collection-errors", *files]
+    logger.info(f"🔍 预收集测试：{len(files)} 个文件")
+    proc, timed_out = _run_with_timeout(argv, repo_str, env, COLLECT_TIMEOUT_S)
+    if timed_out:
+        logger.info(f"⚠️ 预收集超时（超过 {COLLECT_TIMEOUT_S}s），跳过预检。")
+        return set()
+    # 只保留属于所请求文件的 nodeid 行，忽略错误信息、统计行等其余输出
+    requested = set(files)
+    return {line for line in proc.stdout.splitlines() if line.partition('::')[0] in requested and '::' in line}
+
+
+def _is_collected(nodeid: str, collected: set[str]) -> bool:
+    """nodeid 本身被收集到，或它是某些已收集用例的前缀（类、未带参数的参数化用例）。"""
+    if nodeid in collected:
+        return True
+    return any(c.startswith((nodeid + '::', nodeid + '[')) for c in collected)
+
+
+def _run_with_timeout(argv: list[str], cwd: str, env: dict[str, str], timeout: float) -> tuple[subprocess.CompletedProcess, bool]:
+    """
+    运行 argv 并收集输出，超过 timeout 秒时杀掉整个进程组，返回 (结果, 是否超时)。
+    子进程在新会话中启动，SIGKILL 能同时命中 pytest 派生的孙进程，不会残留占用管道。
+    """
+    proc = subprocess.Popen(
+        argv, cwd=cwd, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, start_new_session=True
+    )
+    try:
+        stdout, stderr = proc.communicate(timeout=timeout)
+        timed_out = False
+    except subprocess.TimeoutExpired:
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        stdout, stderr = proc.communicate()
+        timed_out = True
+    return subprocess.CompletedProcess(argv, proc.returncode, stdout, stderr), timed_out
+
+
+def _write_last_failed(repo_dir: str, failed: list[str]) -> None:
+    """用本次运行的结果覆盖 pytest 缓存中的 lastfailed 记录，格式与 pytest 自己写入的一致。"""
+    path = os.path.join(repo_dir, LAST_FAILED_CACHE)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(dict.fromkeys(sorted(failed), True), f, indent=2, sort_keys=True)
+
+
+def _write_logs(logs: list[tuple[str, str]]) -> None:
+    """一次性写出缓存的日志；nodeid 中的 '/' 会形成子目录，每个目录只创建一次。"""
+    for parent in {os.path.dirname(path) for path, _ in logs}:
+        os.makedirs(parent, exist_ok=True)
+    for path, content in logs:
+        with open(path, "w", encoding="utf-8", buffering=LOG_BUFFER_SIZE) as f:
+            f.write(content)
+
+
 def run_tests_on_repo(
     repo_dir: Path,
     tests,
     expect_fail: bool,
-    env_dir: Path
+    env_dir: Path,
+    log_dir: Path | None = None,
+    collected: set[str] | None = None,
+    use_cache: bool = True,
+    last_failed: bool = False
 ) -> dict[str, bool]:
     """
-    在 repo_dir 中逐个执行完整 nodeid 测试。
-    expect_fail=True 时 returncode != 0 视为通过（失败符合预期）；
-    expect_fail=False 时 returncode == 0 视为通过（通过符合预期）。
-    同时输出日志到 .test_logs/{nodeid}.log
+    在 repo_dir 中分批执行完整 nodeid 测试，多批之间用线程池并发，各用例结果从 junitxml 报告中读取；
+    expect_fail=True 时用例未通过视为符合预期，否则通过视为符合预期。运行前先用 collect_tests 预检。
+    use_cache=True 时把本次未通过的用例写入 .pytest_cache 的 lastfailed，last_failed=True 时据此运行一次
+    pytest --lf（不再预检），报告中缺少的用例再分批补跑。日志写入 log_dir（默认 repo_dir/.test_logs）。
     """
-    repo_dir = Path(repo_dir)
-    if not repo_dir.is_dir():
+    # 路径在这里一次性转换为 str，批次与用例循环中只做字符串拼接，不再构造 Path 对象
+    repo_str = os.fspath(repo_dir)
+    if not os.path.isdir(repo_str):
         raise FileNotFoundError(f"❌ 仓库目录未找到: {repo_dir}")
     
-    if not env_dir.exists():
-        raise FileNotFoundError(f"❌ 虚拟环境未找到: {env_dir}")
+    python, env = _venv_python(env_dir)
 
-    log_dir = repo_dir / ".test_logs"
-    log_dir.mkdir(exist_ok=True)
+    # pytest 在 repo_dir 下运行，报告路径必须是绝对路径
+    log_dir_str = os.path.abspath(os.fspath(log_dir) if log_dir is not None else os.path.join(repo_str, ".test_logs"))
+    os.makedirs(log_dir_str, exist_ok=True)
+    status = '失败' if expect_fail else '通过'
+    # 各批次共用的命令行前缀，循环中只追加报告路径与 nodeid
+    pytest_argv = [python, "-m", "pytest", "-q", "--disable-warnings", "--continue-on-collection-errors"]
+    if not use_cache:
+        pytest_argv += ["-p", "no:cacheprovider"]
+    pending_logs: list[tuple[str, str]] = []  # (日志路径, 内容)，各批次线程共同追加
 
-    results: dict[str, bool] = {}
-    for nodeid in _normalize_tests(tests):
-        # 生成日志路径并确保目录存在
-        log_file = log_dir / f"{nodeid.replace('::', '__').replace('[','_').replace(']','')}.log"
-        log_file.parent.mkdir(parents=True, exist_ok=True)  # 创建日志目录（如果不存在）
+    def _run_batch(batch: list[str], lf: bool = False) -> dict[str, bool]:
+        """运行一批 nodeid；lf=True 时不传 nodeid，改用 --lf 运行，batch 只用于从报告中取结果。"""
+        tag = uuid.uuid4().hex[:8]
+        report = f"{log_dir_str}/batch-{tag}.xml"
+        batch_log = f"{log_dir_str}/batch-{tag}.log"
 
-        cmd = f"source ~/autodl-tmp/uv-smith1/{env_dir}/bin/activate && pytest -q --disable-warnings --maxfail=1 {nodeid}"
-        print(f"🎯 执行命令：{cmd}")  # 显示当前运行的命令
+        argv = [*pytest_argv, f"--junitxml={report}", *(LAST_FAILED_ARGS if lf else batch)]
+        cmd = shlex.join(argv)
+        logger.info(f"🎯 执行命令：{cmd}")  # 显示当前运行的命令
 
+        timeout = min(TEST_TIMEOUT_S * len(batch), BATCH_TIMEOUT_S)
         try:
-            proc = subprocess.run(
-                cmd,
-                shell=True,
-                cwd=str(repo_dir),
-                executable="/bin/bash",
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True
-            )
-
-            # 如果测试期望失败时，返回码不为 0 时算通过
-            passed = (proc.returncode != 0) if expect_fail else (proc.returncode == 0)
-            status = '失败' if expect_fail else '通过'
-
-            # 打印结果提示
+            with _PYTEST_SLOTS:
+                proc, timed_out = _run_with_timeout(argv, repo_str, env, timeout)
+        except (OSError, subprocess.SubprocessError) as e:
+            logger.info(f"❌ 命令执行失败：{e}")
+            with open(batch_log, "w", encoding="utf-8", buffering=LOG_BUFFER_SIZE) as f:
+                f.write(f"=== COMMAND ===\n{cmd}\n\n=== ERROR ===\n{e}\n")
+            return _run_batches(batch) if lf else {nodeid: False for nodeid in batch}
+
+        with open(batch_log, "w", encoding="utf-8", buffering=LOG_BUFFER_SIZE) as f:
+            f.write(f"=== COMMAND ===\n{cmd}\n\n")
+            f.write(f"=== STDOUT ===\n{proc.stdout}\n\n")
+            f.write(f"=== STDERR ===\n{proc.stderr}\n")
+
+        # 用法错误（如某个 nodeid 对应的文件不存在）时整批都不会运行；超时被杀时也拿不到报告。
+        # 两种情况都拆成单个 nodeid 重跑，把问题限定在具体的用例上；--lf 运行则退回正常分批
+        if (timed_out or proc.returncode == USAGE_ERROR) and (lf or len(batch) > 1):
+            reason = f"批次运行超时（超过 {timeout}s）" if timed_out else f"批次参数错误（错误码 {proc.returncode}）"
+            if lf:
+                logger.info(f"⚠️ --lf {reason}，改为分批运行 {len(batch)} 个测试。")
+                return _run_batches(batch)
+            logger.info(f"⚠️ {reason}，改为逐个运行 {len(batch)} 个测试。")
+            return _run_batches(batch, size=1)
+
+        outcomes = _parse_junit(report) if os.path.exists(report) else {}
+        missing_detail = (f"运行超时（超过 {timeout}s）被强制终止" if timed_out
+                          else '该测试未出现在 pytest 报告中（未收集或未运行）')
+        results = {}
+        if lf:
+            # --lf 报告中缺少的用例（如记录在收集时未能匹配）去掉 --lf 补跑；记录中多出的用例不计入结果
+            skipped = [nodeid for nodeid in batch if _lookup_outcome(outcomes, nodeid) is None]
+            if skipped:
+                logger.info(f"↪ {len(skipped)} 个测试未出现在 --lf 报告中，改为分批补跑。")
+                results.update(_run_batches(skipped))
+        lines: list[str] = []
+        for nodeid in batch:
+            if nodeid in results:
+                continue
+            outcome = _lookup_outcome(outcomes, nodeid)
+            if outcome is None:
+                # 报告中找不到对应用例时，退回按整批的返回码判断
+                ran_ok = proc.returncode == 0 and not timed_out
+                outcome = (ran_ok, '' if ran_ok else missing_detail)
+            ran_ok, detail = outcome
+            passed = (not ran_ok) if expect_fail else ran_ok
+            results[nodeid] = passed
+
+            # 结果提示先收集起来，整个批次处理完后作为一条日志输出
             if passed:
-                print(f"✅ 测试 '{nodeid}' 符合预期（{status}）。")
+                lines.append(f"✅ 测试 '{nodeid}' 符合预期（{status}）。")
             else:
-                print(f"❌ 测试 '{nodeid}' 未达预期（未{status}）。")
-                print(f"   ↪ 错误码: {proc.returncode}")
-                print(f"   ↪ stderr: {proc.stderr.strip()[:300]}{'...' if len(proc.stderr) > 300 else ''}")
-
-            # 保存日志
-            with log_file.open("w", encoding="utf-8") as f:
-                f.write(f"=== COMMAND ===\n{cmd}\n\n")
-                f.write(f"=== STDOUT ===\n{proc.stdout}\n\n")
-                f.write(f"=== STDERR ===\n{proc.stderr}\n")
-            
-        except subprocess.CalledProcessError as e:
-            print(f"❌ 命令执行失败：{e}")
-            with log_file.open("w", encoding="utf-8") as f:
-                f.write(f"=== ERROR ===\n{e}\n")
-        
-        # 如果没有出错，记录测试结果
-        results[nodeid] = passed
-
-    return results
+                lines.append(f"❌ 测试 '{nodeid}' 未达预期（未{status}）。")
+                lines.append(f"   ↪ 批次错误码: {proc.returncode}")
+                if detail:
+                    lines.append(f"   ↪ 详情: {detail.strip()[:300]}{'...' if len(detail) > 300 else ''}")
+
+            # 单个用例的日志先缓存在内存中，全部批次结束后统一写盘
+            pending_logs.append((
+                f"{log_dir_str}/{nodeid.replace('::', '__').translate(_SANITIZE)}.log",
+                f"=== COMMAND ===\n{cmd}\n\n"
+                f"=== RESULT ===\n{'passed' if ran_ok else 'not passed'}\n\n"
+                f"=== DETAILS ===\n{detail}\n\n"
+                f"=== BATCH LOG ===\n{batch_log}\n"
+            ))
+
+        logger.info("\n".join(lines))
+        return results
+
+    def _run_batches(ids: list[str], size: int | None = None) -> dict[str, bool]:
+        # 每批一个 pytest 进程以摊薄解释器启动与收集开销；
+        # 测试较少时把批次切小一些，让各 CPU 核都能分到一批（逐个重跑时 size=1）
+        workers = os.cpu_count() or 1
+        if size is None:
+            size = min(BATCH_SIZE, -(-len(ids) // workers))
+        batches = [ids[i:i + size] for i in range(0, len(ids), size)]
+        results: dict[str, bool] = {}
+        with ThreadPoolExecutor(max_workers=min(len(batches), workers)) as ex:
+            for batch_results in ex.map(_run_batch, batches):
+                results.update(batch_results)
+        return results
+
+    nodeids = _normalize_tests(tests)
+    if not nodeids:
+        return {}
+
+    # --lf 模式只收集失败记录涉及的文件，不再做一次完整的预收集；
+    # 记录由上一阶段在运行结束后统一写入（见下方），不受并发批次互相覆盖的影响
+    lf = last_failed and use_cache and os.path.exists(os.path.join(repo_str, LAST_FAILED_CACHE))
+    if lf:
+        try:
+            results = _run_batch(nodeids, lf=True)
+        finally:
+            _write_logs(pending_logs)
+        _write_last_failed(repo_str, [nodeid for nodeid in nodeids if results[nodeid] == expect_fail])
+        return {nodeid: results[nodeid] for nodeid in nodeids}
+
+    # 预检：不存在的 nodeid（拼写错误、文件缺失）直接判定，不必再为它们启动一次完整的 pytest
+    if collected is None:
+        collected = collect_tests(repo_str, nodeids, env_dir)
+    collected_files = {c.partition('::')[0] for c in collected}
+    merged: dict[str, bool] = {}
+    for nodeid in nodeids:
+        path = nodeid.partition('::')[0]
+        if not os.path.exists(os.path.join(repo_str, path)):
+            reason = "所在文件不存在"
+        elif path in collected_files and not _is_collected(nodeid, collected):
+            reason = "文件中没有该用例"
+        else:
+            # 文件收集出错时没有任何 nodeid 可供比对，交给批次运行按实际结果判定
+            continue
+        merged[nodeid] = False
+        logger.info(f"❌ 测试 '{nodeid}' {reason}，跳过运行。")
+    to_run = [nodeid for nodeid in nodeids if nodeid not in merged]
+    if not to_run:
+        return {nodeid: merged[nodeid] for nodeid in nodeids}
+
+    try:
+        merged.update(_run_batches(to_run))
+    finally:
+        _write_logs(pending_logs)
+    if use_cache:
+        # 各批次的 pytest 进程会互相覆盖 lastfailed，这里按汇总后的结果重写一次，供 last_failed 使用
+        _write_last_failed(repo_str, [nodeid for nodeid in to_run if merged[nodeid] == expect_fail])
+    return {nodeid: merged[nodeid] for nodeid in nodeids}
+
+
+
+def run_test_phases(
+    repo_dir: Path,
+    fail_tests,
+    pass_tests,
+    env_dir: Path,
+    log_dir: Path | None = None
+) -> tuple[dict[str, bool], dict[str, bool]]:
+    """
+    并发运行首次验证的两个阶段：FAIL_TO_PASS 应失败，PASS_TO_PASS 应通过，返回 (fail 结果, pass 结果)。
+    两组测试先统一收集一次，作为两个阶段共用的预检集合；PASS_TO_PASS 不读写 .pytest_cache，
+    lastfailed 只记录 FAIL_TO_PASS 的结果。两个阶段共享 _PYTEST_SLOTS 名额，不会超额启动进程。
+    """
+    fail_tests, pass_tests = _normalize_tests(fail_tests), _normalize_tests(pass_tests)
+    collected = collect_tests(repo_dir, fail_tests + pass_tests, env_dir)
+    with ThreadPoolExecutor(max_workers=2) as ex:
+        fut_fail = ex.submit(run_tests_on_repo, repo_dir, fail_tests, expect_fail=True, env_dir=env_dir,
+                             log_dir=log_dir, collected=collected)
+        fut_pass = ex.submit(run_tests_on_repo, repo_dir, pass_tests, expect_fail=False, env_dir=env_dir,
+                             log_dir=log_dir, collected=collected, use_cache=False)
+        return fut_fail.result(), fut_pass.result()
 
 
 if __name__ == '__main__':
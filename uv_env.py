@@ -4,7 +4,8 @@
 uv_env.py —— 环境准备模块（健壮版）：
 提供 setup_environment(uv_env_name: str) 函数，
 在指定基础目录下创建并配置 uv 虚拟环境。
-此版本包含健康检查与自我修复机制，确保 pip 一定被成功安装。
+依赖统一用 `uv pip install --python <env>/bin/python` 安装（并行解析下载、复用全局 wheel 缓存）；
+系统中没有 uv 时退回标准库 venv + pip，并保留 pip 的健康检查与 ensurepip 自我修复。
 
 使用者需在脚本顶部定义以下配置：
     ENV_BASE_DIR   = Path('env/')
@@ -12,15 +13,26 @@ uv_env.py —— 环境准备模块（健壮版）：
 
 接口：
     setup_environment(uv_env_name)
-    - uv_env_name (str): 虚拟环境名称，将作为子目录创建在 ENV_BASE_DIR 下
+    - uv_env_name (str): 虚拟环境名称，与 requirements.txt 内容的哈希一起组成
+      ENV_BASE_DIR 下的子目录名 <uv_env_name>-<hash12>
 
 返回：
     env_path (Path): 创建的虚拟环境完整路径
 
+缓存：
+    - 同一进程内重复调用同名环境时直接返回缓存结果（functools.lru_cache）
+    - 环境目录按 requirements.txt 内容的 SHA256 命名，依赖不变时跨进程复用同一环境；
+      依赖改变时自动落到新目录，不会误用旧依赖
+    - 环境配置完成后写入 .env_ready 标记文件；复用前再做一次健康检查
+      （环境中的 python 能导入 pytest），通过才跳过 uv venv 与依赖安装
+
 示例用法：
     env = setup_environment('myenv')
 """
+from functools import lru_cache
 from pathlib import Path
+import hashlib
+import shutil
 import subprocess
 import sys
 
@@ -29,34 +41,25 @@ ENV_BASE_DIR  = Path('env')  # 虚拟环境所在目录
 REQ_FILE_PATH = Path('requirements.txt')  # 项目内 requirements.txt 路径
 # -------------------------------------------------------
 
-def setup_environment(uv_env_name: str) -> Path:
-    """
-    在 ENV_BASE_DIR 下创建名为 uv_env_name 的 uv 虚拟环境，
-    确保 pip 被正确安装，然后使用 REQ_FILE_PATH 安装依赖。
-    """
-    ENV_BASE_DIR.mkdir(parents=True, exist_ok=True)
-    env_path = ENV_BASE_DIR / uv_env_name
+READY_SENTINEL = '.env_ready'  # 环境配置完成后写入的标记文件
+UV_EXE = shutil.which("uv")     # 未安装 uv 时为 None，退回标准库 venv + pip
 
-    # 步骤 1: 创建或清理虚拟环境
-    print(f"正在创建或清理虚拟环境: {env_path}")
-    try:
-        # 使用 --clear 选项确保环境是干净的
-        subprocess.run(["uv", "venv", str(env_path), "--clear"], check=True)
-    except subprocess.CalledProcessError as e:
-        raise RuntimeError(f"无法创建 uv 虚拟环境: {env_path}: {e}")
 
-    # 步骤 2: 定位新环境的 Python 解释器
-    target_python = env_path / "bin" / "python"
-    if not target_python.is_file():
-        raise FileNotFoundError(f"创建环境后，未找到 Python 解释器: {target_python}")
+def _install_argv(target_python: Path, *args: str) -> list[str]:
+    """安装依赖的命令行：优先 uv pip（并行下载、全局 wheel 缓存），没有 uv 时退回环境内的 pip。"""
+    if UV_EXE:
+        return [UV_EXE, "pip", "install", "--python", str(target_python), *args]
+    return [str(target_python), "-m", "pip", "install", *args]
+
 
-    # --- 核心改动：健康检查与自我修复机制 ---
+def _ensure_pip(target_python: Path, env_path: Path) -> None:
+    """确认环境中的 pip 可用，缺失时用 ensurepip 修复。"""
     try:
         print("正在检查新环境中 pip 是否可用...")
         # 尝试用新环境的 python 运行 pip，如果失败，说明 pip 没被正确安装
         subprocess.run(
-            [str(target_python), "-m", "pip", "--version"], 
-            check=True, 
+            [str(target_python), "-m", "pip", "--version"],
+            check=True,
             capture_output=True  # 隐藏成功时的输出，保持日志整洁
         )
         print("✅ pip 已存在。")
@@ -70,22 +73,70 @@ def setup_environment(uv_env_name: str) -> Path:
         except subprocess.CalledProcessError as ensure_e:
             raise RuntimeError(f"在新环境中手动安装 pip 失败，环境已损坏，请检查系统配置: {ensure_e}")
 
-    # 步骤 3: 在健康的环境中安装依赖
+
+def _requirements_digest() -> str:
+    """requirements.txt 内容的 SHA256 前 12 位；文件不存在时按空内容计算。"""
+    data = REQ_FILE_PATH.read_bytes() if REQ_FILE_PATH.exists() else b""
+    return hashlib.sha256(data).hexdigest()[:12]
+
+
+def _env_is_ready(env_path: Path) -> bool:
+    """环境已配置完成（存在标记文件），且其中的 python 能正常导入 pytest 时返回 True。"""
+    target_python = env_path / "bin" / "python"
+    if not (env_path / READY_SENTINEL).is_file() or not target_python.is_file():
+        return False
+    probe = subprocess.run([str(target_python), "-c", "import pytest"], capture_output=True)
+    return probe.returncode == 0
+
+
+@lru_cache(maxsize=32)
+def setup_environment(uv_env_name: str) -> Path:
+    """
+    在 ENV_BASE_DIR 下创建名为 <uv_env_name>-<requirements 哈希> 的 uv 虚拟环境，
+    然后使用 REQ_FILE_PATH 安装依赖（优先 uv pip）。
+    同一份依赖的环境已就绪（见 _env_is_ready）时直接返回，不再重复创建。
+    """
+    ENV_BASE_DIR.mkdir(parents=True, exist_ok=True)
+    env_path = ENV_BASE_DIR / f"{uv_env_name}-{_requirements_digest()}"
+
+    if _env_is_ready(env_path):
+        print(f"✅ 环境 '{env_path.name}' 已就绪，跳过创建与依赖安装。")
+        return env_path
+
+    # 步骤 1: 创建或清理虚拟环境
+    print(f"正在创建或清理虚拟环境: {env_path}")
     try:
-        # 确保 pytest 被安装
-        print("正在安装 pytest...")
-        subprocess.run([str(target_python), "-m", "pip", "install", "pytest"], check=True)
+        # 使用 --clear 选项确保环境是干净的；没有 uv 时退回标准库 venv（自带 pip）
+        if UV_EXE:
+            subprocess.run([UV_EXE, "venv", str(env_path), "--clear"], check=True)
+        else:
+            subprocess.run([sys.executable, "-m", "venv", "--clear", str(env_path)], check=True)
+    except subprocess.CalledProcessError as e:
+        raise RuntimeError(f"无法创建虚拟环境: {env_path}: {e}")
 
+    # 步骤 2: 定位新环境的 Python 解释器
+    target_python = env_path / "bin" / "python"
+    if not target_python.is_file():
+        raise FileNotFoundError(f"创建环境后，未找到 Python 解释器: {target_python}")
+
+    # 只有退回 pip 安装时才需要确认环境中有 pip；uv pip 直接操作目标解释器，不依赖环境内的 pip
+    if not UV_EXE:
+        _ensure_pip(target_python, env_path)
+
+    # 步骤 3: 在健康的环境中安装依赖（pytest 与 requirements 一次解析、一次安装）
+    try:
+        args = ["pytest"]
         if REQ_FILE_PATH.exists():
-            print(f"正在从 {REQ_FILE_PATH} 安装依赖...")
-            subprocess.run(
-                [str(target_python), "-m", "pip", "install", "-r", str(REQ_FILE_PATH)],
-                check=True
-            )
-            print("成功安装 requirements")
+            args += ["-r", str(REQ_FILE_PATH)]
+            print(f"正在安装 pytest 及 {REQ_FILE_PATH} 中的依赖...")
+        else:
+            print("正在安装 pytest...")
+        subprocess.run(_install_argv(target_python, *args), check=True)
+        print("成功安装依赖")
     except subprocess.CalledProcessError as e:
         raise RuntimeError(f"在环境 '{env_path.name}' 中安装依赖失败: {e}")
 
+    (env_path / READY_SENTINEL).touch()
     print(f"✅ 环境 '{env_path.name}' 已成功创建并配置完毕。")
     return env_path
 